@@ -1,33 +1,139 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import re
+import sys
 import time
 import os
 import importlib
+import ast
 import threading
-from http.server import SimpleHTTPRequestHandler, HTTPServer
+import hashlib
+import atexit
+import copy
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import orjson   # optional, much faster decoding of the many small stream chunks
+except ImportError:
+    orjson = None
+
+
+# ====================== JSON HELPERS ======================
+def json_loads(data):
+    if orjson:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass   # e.g. lone surrogate escapes, which the stdlib still accepts
+    return json.loads(data)
+
+
+def json_dumps_bytes(obj, sort_keys=False):
+    """Compact UTF-8 JSON, same output with orjson or the stdlib fallback."""
+    if orjson:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+        except TypeError:
+            pass   # e.g. integers beyond 64 bits or lone surrogates, let the stdlib handle it
+    try:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, sort_keys=sort_keys).encode('utf-8')
+    except UnicodeEncodeError:
+        # Lone surrogates have no UTF-8 form, only \u escapes can carry them
+        return json.dumps(obj, separators=(",", ":"), sort_keys=sort_keys).encode('utf-8')
+
+
+def json_dumps(obj, sort_keys=False):
+    return json_dumps_bytes(obj, sort_keys).decode('utf-8')
+
 
 # ====================== TOOL LOADER ======================
+_TOOL_META_KEYS = ('schema', 'parallel_safe', 'cacheable')
+_TOOL_LOADERS = {}   # tool name -> module name, imported on first use
+_TOOL_IMPORT_LOCK = threading.Lock()
+_TOOL_FILES_CACHE = (None, [])
+
+
+def _list_tool_files():
+    """Lists *_tool.py files, rescanning the directory only when its mtime changes."""
+    global _TOOL_FILES_CACHE
+    mtime = os.stat('.').st_mtime_ns
+    if _TOOL_FILES_CACHE[0] != mtime:
+        _TOOL_FILES_CACHE = (mtime, sorted(f for f in os.listdir('.') if f.endswith('_tool.py')))
+    return _TOOL_FILES_CACHE[1]
+
+
+def _read_tool_metadata(filename):
+    """
+    Reads schema, parallel_safe and cacheable from a tool file without executing it,
+    so a tool's heavy imports are only paid when it is first called.
+    Returns None when those values are not plain literals, or the tool function is not a
+    top-level def (imported or assigned), and the module must be imported.
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=filename)
+    meta = {'functions': {}}
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef):
+            meta['functions'][node.name] = None
+        elif (isinstance(node, ast.Assign) and len(node.targets) == 1
+              and isinstance(node.targets[0], ast.Name) and node.targets[0].id in _TOOL_META_KEYS):
+            try:
+                meta[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                return None
+    if 'schema' in meta and meta['schema']['function']['name'] not in meta['functions']:
+        return None
+    return meta
+
+
 def load_tools():
     tools = {}
     schemas = []
-    # Ensure current directory is in path for imports if needed, though usually not required for current dir
-    for filename in os.listdir('.'):
-        if filename.endswith('_tool.py'):
-            module_name = filename[:-3]
-            try:
+    for filename in _list_tool_files():
+        module_name = filename[:-3]
+        try:
+            meta = _read_tool_metadata(filename)
+            if meta is None:
                 module = importlib.import_module(module_name)
-                if hasattr(module, 'schema'):
-                    sch = module.schema
-                    tool_name = sch['function']['name']
-                    if hasattr(module, tool_name):
-                        tools[tool_name] = getattr(module, tool_name)
-                        schemas.append(sch)
-                        print(f"   Loaded tool: {tool_name}")
-            except Exception as e:
-                print(f"   Failed to load {filename}: {e}")
+                meta = {key: getattr(module, key) for key in _TOOL_META_KEYS if hasattr(module, key)}
+                meta['functions'] = vars(module)
+            if 'schema' in meta:
+                sch = meta['schema']
+                tool_name = sch['function']['name']
+                if tool_name in meta['functions']:
+                    # Tools that must not interleave with others declare parallel_safe = False,
+                    # read-only tools whose results can be reused declare cacheable = True
+                    parallel_safe = meta.get('parallel_safe', True)
+                    cacheable = meta.get('cacheable', False)
+                    fn = meta['functions'][tool_name]
+                    if fn is None:
+                        _TOOL_LOADERS[tool_name] = module_name
+                    tools[tool_name] = (fn, parallel_safe, cacheable)
+                    schemas.append(sch)
+                    print(f"   Loaded tool: {tool_name}")
+        except Exception as e:
+            print(f"   Failed to load {filename}: {e}")
     return tools, schemas
 
 
+def resolve_tool(fname):
+    """Returns the callable for a tool, importing its module on first use."""
+    fn = TOOLS[fname][0]
+    if fn is None:
+        with _TOOL_IMPORT_LOCK:
+            fn, parallel_safe, cacheable = TOOLS[fname]
+            if fn is None:
+                module = importlib.import_module(_TOOL_LOADERS[fname])
+                fn = getattr(module, fname)
+                TOOLS[fname] = (fn, parallel_safe, cacheable)
+    return fn
+
+
 # ====================== CONFIG ======================
 LLAMA_SERVER_URL = "http://127.0.0.1:8080/v1/chat/completions"
 MODEL = "llama-3.1-8b-instruct"
@@ -35,10 +141,61 @@ TIMEOUT = 600
 MAX_RETRIES = 3
 WEB_PORT = 8000
 
+# Sliding window: system prompt plus at most this many messages are sent to the model
+MAX_CONTEXT_MESSAGES = int(os.environ.get("MAX_CONTEXT_MESSAGES", "40"))
+
+# Streamed tokens are written to stdout in batches instead of one flush per token
+FLUSH_EVERY_TOKENS = 8
+FLUSH_INTERVAL = 0.03   # seconds
+
+# Persistent keep-alive connections to the model server instead of a new TCP connection per turn.
+# Retries happen at the connection layer, before any streamed data is consumed.
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=MAX_RETRIES,
+        backoff_factor=1.5,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(["POST"]),
+        raise_on_status=False
+    )
+))
+
+# Worker pool for running tool calls from a single model response concurrently
+TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=8)
+MAX_TOOL_CONCURRENCY = int(os.environ.get("MAX_TOOL_CONCURRENCY", "5"))
+TOOL_SEMAPHORE = threading.BoundedSemaphore(MAX_TOOL_CONCURRENCY)
+
+# Cache of final assistant messages keyed by request hash (set LLM_CACHE_DISABLED=1 to turn off)
+LLM_CACHE_FILE = os.path.join('data', 'llm_cache.json')
+LLM_CACHE_SIZE = 256
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_DISABLED", "") not in ("1", "true", "yes")
+
 # Load tools automatically
 TOOLS, TOOLS_SCHEMAS = load_tools()
 print(f"✅ Loaded {len(TOOLS)} tools\n")
 
+# Everything in the request except the messages is fixed, so it is serialised once here
+# and the body is assembled from pre-encoded bytes on every call
+_REQUEST_HEAD = b'{"model":' + json_dumps_bytes(MODEL) + b',"messages":'
+_REQUEST_TAIL = b',"tools":' + json_dumps_bytes(TOOLS_SCHEMAS) + b',' + json_dumps_bytes({
+    "tool_choice": "auto",
+    "stream": True,
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "max_tokens": 4096,
+    "presence_penalty": 0.0,
+    "frequency_penalty": 0.0
+})[1:]
+REQUEST_HEADERS = {"Content-Type": "application/json"}
+
+
+def build_request_body(messages):
+    return _REQUEST_HEAD + json_dumps_bytes(messages) + _REQUEST_TAIL
+
+
 # Shared history for the session (simplistic approach for single-user local tool)
 HISTORY = [
     {
@@ -54,133 +211,410 @@ HISTORY = [
     }
 ]
 
+# CLI and web requests share HISTORY, so a whole turn (user message, model calls, tool results)
+# runs under this lock to keep concurrent turns from interleaving their messages
+HISTORY_LOCK = threading.Lock()
 
-# ====================== STREAMING WITH REALTIME CONNECTION ======================
-def stream_model(messages):
-    payload = {
-        "model": MODEL,
-        "messages": messages,
-        "tools": TOOLS_SCHEMAS,
-        "tool_choice": "auto",
-        "stream": True,
-        "temperature": 0.7,
-        "top_p": 0.95,
-        "max_tokens": 4096,
-        "presence_penalty": 0.0,
-        "frequency_penalty": 0.0
-    }
 
-    print("\nConnecting to server...", end="", flush=True)
+# ====================== LLM RESPONSE CACHE ======================
+def load_llm_cache():
+    cache = OrderedDict()
+    if LLM_CACHE_ENABLED and os.path.exists(LLM_CACHE_FILE):
+        try:
+            with open(LLM_CACHE_FILE, 'r', encoding='utf-8') as f:
+                cache.update(json.load(f))
+            print(f"✅ Loaded {len(cache)} cached responses\n")
+        except Exception as e:
+            print(f"   Failed to load {LLM_CACHE_FILE}: {e}")
+    return cache
+
+
+def save_llm_cache():
+    """Writes the cache atomically so a crash never leaves a truncated file."""
+    if not LLM_CACHE_ENABLED or not LLM_CACHE:
+        return
+    try:
+        os.makedirs(os.path.dirname(LLM_CACHE_FILE), exist_ok=True)
+        tmp_path = LLM_CACHE_FILE + '.tmp'
+        with LLM_CACHE_LOCK:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(LLM_CACHE, f)
+        os.replace(tmp_path, LLM_CACHE_FILE)
+    except Exception as e:
+        print(f"   Failed to save {LLM_CACHE_FILE}: {e}")
+
+
+def llm_cache_key(body):
+    """Hashes the request body (messages, tool schemas, model and sampling params) into a key."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def llm_cache_get(key):
+    with LLM_CACHE_LOCK:
+        msg = LLM_CACHE.get(key)
+        if msg is None:
+            return None
+        LLM_CACHE.move_to_end(key)
+        return copy.deepcopy(msg)
+
+
+def llm_cache_put(key, msg):
+    # Replaying tool calls is only safe when every referenced tool is cacheable
+    calls = msg.get("tool_calls") or ([{"function": msg["function_call"]}] if msg.get("function_call") else [])
+    if not all(TOOLS.get(tc["function"]["name"], (None, False, False))[2] for tc in calls):
+        return
+    with LLM_CACHE_LOCK:
+        LLM_CACHE[key] = copy.deepcopy(msg)
+        LLM_CACHE.move_to_end(key)
+        while len(LLM_CACHE) > LLM_CACHE_SIZE:
+            LLM_CACHE.popitem(last=False)
+
+
+LLM_CACHE_LOCK = threading.Lock()
+LLM_CACHE = load_llm_cache()
+atexit.register(save_llm_cache)
+
+
+# ====================== SSE PARSER ======================
+def _sse_event_data(event):
+    """Joins the data fields of one SSE event as bytes, or returns None if it carries no data."""
+    if event.startswith(b"data: ") and b"\n" not in event:
+        return event[6:]   # common case, single-line event
+    data_lines = [line[6:] if line.startswith(b"data: ") else line[5:]
+                  for line in event.split(b"\n") if line.startswith(b"data:")]
+    return b"\n".join(data_lines) if data_lines else None
+
+
+def _normalize_line_endings(buffer, final=False):
+    """
+    Turns the SSE line endings CRLF and lone CR into LF. Normalising the buffer, not each chunk,
+    handles a CRLF split across chunks; a trailing CR is held back until the next chunk shows
+    whether an LF follows it.
+    """
+    held = b""
+    if not final and buffer.endswith(b"\r"):
+        buffer, held = buffer[:-1], b"\r"
+    return buffer.replace(b"\r\n", b"\n").replace(b"\r", b"\n") + held
 
-    accumulated_content = ""
-    accumulated_tool_calls = []
-    accumulated_function_call = {"name": "", "arguments": ""}
-    token_count = 0
-    start_time = None
 
-    for attempt in range(MAX_RETRIES):
-        try:
-            with requests.post(LLAMA_SERVER_URL, json=payload, stream=True, timeout=TIMEOUT) as resp:
-                resp.raise_for_status()
-                print(" Connected ✓", flush=True)
-                print("Assistant: ", end="", flush=True)
+def iter_sse_data(resp):
+    """
+    Incrementally parses a Server-Sent Events stream and yields the raw data payload of each event.
+    Several events may arrive in one chunk and one event may span chunks, so complete events
+    are split off a running buffer at the blank-line separator. Everything stays bytes so only
+    the JSON payload is decoded, once, by the JSON parser.
+    """
+    buffer = b""
+    for raw in resp.iter_content(chunk_size=None):
+        if not raw:
+            continue
+        buffer += raw
+        if b"\r" in buffer:
+            buffer = _normalize_line_endings(buffer)
+        while True:
+            sep = buffer.find(b"\n\n")
+            if sep == -1:
+                break
+            data = _sse_event_data(buffer[:sep])
+            buffer = buffer[sep + 2:]
+            if data is not None:
+                yield data
+    # Some servers close the stream without a trailing blank line
+    data = _sse_event_data(_normalize_line_endings(buffer, final=True).strip())
+    if data is not None:
+        yield data
 
-                for line in resp.iter_lines(decode_unicode=True):
-                    if not line or not line.startswith("data: "):
-                        continue
-                    data = line[6:].strip()
-                    if data == "[DONE]":
-                        break
-                    try:
-                        chunk = json.loads(data)
-                    except json.JSONDecodeError:
-                        continue
 
-                    delta = chunk.get("choices", [{}])[0].get("delta", {})
-
-                    if delta.get("content") is not None:
-                        token = delta["content"]
-                        if start_time is None:
-                            start_time = time.time()
-                        print(token, end="", flush=True)
-                        accumulated_content += token
-                        token_count += 1
-
-                    if "tool_calls" in delta:
-                        for tc_delta in delta["tool_calls"]:
-                            idx = tc_delta.get("index", 0)
-                            while len(accumulated_tool_calls) <= idx:
-                                accumulated_tool_calls.append({
-                                    "id": "", "type": "function", "function": {"name": "", "arguments": ""}
-                                })
-                            tc = accumulated_tool_calls[idx]
-                            if "id" in tc_delta:
-                                tc["id"] += tc_delta.get("id", "")
-                            if "function" in tc_delta:
-                                f = tc_delta["function"]
-                                if "name" in f:
-                                    tc["function"]["name"] += f.get("name", "")
-                                if "arguments" in f:
-                                    tc["function"]["arguments"] += f.get("arguments", "")
-
-                    if "function_call" in delta:
-                        fc = delta["function_call"]
-                        if "name" in fc:
-                            accumulated_function_call["name"] += fc.get("name", "")
-                        if "arguments" in fc:
-                            accumulated_function_call["arguments"] += fc.get("arguments", "")
+# ====================== STREAMING WITH REALTIME CONNECTION ======================
+_SURROGATE_RE = re.compile('[\ud800-\udfff]')
 
-                break
 
-        except Exception as e:
-            if attempt == MAX_RETRIES - 1:
-                print(" Failed ✗")
-                print(f"   [Connection error: {e}]")
-                accumulated_content = f"[Error: {e}]"
-                break
-            wait = (2 ** attempt) * 1.5
-            print(f" Failed (retry {attempt+1}/{MAX_RETRIES} in {wait:.1f}s)", flush=True)
-            time.sleep(wait)
-            print("Connecting to server...", end="", flush=True)
+def stream_model(messages, on_token=None, early_calls=None):
+    """
+    Streams one assistant message from the model server and returns it.
+    If early_calls is a dict, parallel-safe tool calls are started as soon as their
+    arguments are complete and their futures are recorded in it (see dispatch_tool_early).
+    """
+    body = build_request_body(messages)
+
+    cache_key = llm_cache_key(body) if LLM_CACHE_ENABLED else None
+    if cache_key:
+        cached = llm_cache_get(cache_key)
+        if cached is not None:
+            print("\nAssistant (cached): ", end="", flush=True)
+            print(cached.get("content") or "", flush=True)
+            if on_token and cached.get("content"):
+                on_token(cached["content"])
+            return cached
 
+    print("\nConnecting to server...", end="", flush=True)
+
+    # Fragments are collected in lists and joined once at the end (linear, no repeated string copies)
+    content_parts = []
+    accumulated_tool_calls = []
+    accumulated_function_call = {"name": [], "arguments": []}
+    argument_trackers = {}
+    start_time = None
+    completed = False   # set by [DONE] or a finish_reason, only complete answers are cached
+    pending = []
+    last_flush = time.perf_counter()
+
+    def flush_pending():
+        nonlocal last_flush
+        if pending:
+            text = "".join(pending)
+            pending.clear()
+            try:
+                sys.stdout.write(text)
+            except UnicodeEncodeError:
+                sys.stdout.write(text.encode('utf-8', 'ignore').decode('utf-8'))
+            sys.stdout.flush()
+        last_flush = time.perf_counter()
+
+    # Connection failures and 502/503/504 are retried with backoff by the session adapter
+    try:
+        with SESSION.post(LLAMA_SERVER_URL, data=body, headers=REQUEST_HEADERS,
+                          stream=True, timeout=TIMEOUT) as resp:
+            resp.raise_for_status()
+            print(" Connected ✓", flush=True)
+            print("Assistant: ", end="", flush=True)
+
+            for data in iter_sse_data(resp):
+                if data.startswith(b"[DONE]"):
+                    completed = True
+                    break
+                try:
+                    chunk = json_loads(data)
+                except ValueError:   # also UnicodeDecodeError on invalid UTF-8
+                    continue
+
+                choice = (chunk.get("choices") or [{}])[0]
+                if choice.get("finish_reason"):
+                    completed = True
+                delta = choice.get("delta", {})
+
+                if delta.get("content") is not None:
+                    token = delta["content"]
+                    if start_time is None:
+                        start_time = time.perf_counter()
+                    content_parts.append(token)
+                    pending.append(token)
+                    if on_token:
+                        on_token(token)
+                    if len(pending) >= FLUSH_EVERY_TOKENS or time.perf_counter() - last_flush > FLUSH_INTERVAL:
+                        flush_pending()
+
+                if "tool_calls" in delta:
+                    for tc_delta in delta["tool_calls"]:
+                        idx = tc_delta.get("index", 0)
+                        while len(accumulated_tool_calls) <= idx:
+                            accumulated_tool_calls.append({
+                                "id": [], "type": "function", "function": {"name": [], "arguments": []}
+                            })
+                        tc = accumulated_tool_calls[idx]
+                        if tc_delta.get("id"):
+                            tc["id"].append(tc_delta["id"])
+                        if "function" in tc_delta:
+                            f = tc_delta["function"]
+                            if f.get("name"):
+                                tc["function"]["name"].append(f["name"])
+                            if f.get("arguments"):
+                                tc["function"]["arguments"].append(f["arguments"])
+                                # Start the tool while the rest of the response is still streaming
+                                tracker = argument_trackers.setdefault(idx, JsonObjectTracker())
+                                if tracker.feed(f["arguments"]) and early_calls is not None:
+                                    dispatch_tool_early("".join(tc["function"]["name"]),
+                                                        "".join(tc["function"]["arguments"]),
+                                                        early_calls)
+
+                if "function_call" in delta:
+                    fc = delta["function_call"]
+                    if fc.get("name"):
+                        accumulated_function_call["name"].append(fc["name"])
+                    if fc.get("arguments"):
+                        accumulated_function_call["arguments"].append(fc["arguments"])
+
+            flush_pending()
+
+    except Exception as e:
+        flush_pending()
+        print(" Failed ✗")
+        print(f"   [Connection error: {e}]")
+        content_parts[:] = [f"[Error: {e}]"]
+        completed = False
+
+    # Every content delta is one entry in content_parts, so no per-token counter is needed
+    token_count = len(content_parts)
     if token_count > 3 and start_time is not None:
-        elapsed = time.time() - start_time
+        elapsed = time.perf_counter() - start_time
         speed = token_count / elapsed
         print(f"  ({speed:.1f} tokens/s)", end="")
     print()
 
-    # Stronger cleaning of bad characters
-    accumulated_content = accumulated_content.strip()
-    accumulated_content = accumulated_content.encode('utf-8', 'ignore').decode('utf-8')
+    # Decoded JSON strings are valid Unicode except for lone surrogates from "\ud800"-style escapes,
+    # so the costly encode/decode cleaning only runs when one is actually present
+    accumulated_content = "".join(content_parts).strip()
+    if _SURROGATE_RE.search(accumulated_content):
+        accumulated_content = accumulated_content.encode('utf-8', 'ignore').decode('utf-8')
 
     msg = {"role": "assistant", "content": accumulated_content or None}
 
     if accumulated_tool_calls:
         clean = []
         for tc in accumulated_tool_calls:
-            if tc["function"]["name"]:
+            name = "".join(tc["function"]["name"])
+            if name:
                 clean.append({
-                    "id": tc["id"] or None,
+                    "id": "".join(tc["id"]) or None,
                     "type": "function",
                     "function": {
-                        "name": tc["function"]["name"],
-                        "arguments": tc["function"]["arguments"]
+                        "name": name,
+                        "arguments": "".join(tc["function"]["arguments"])
                     }
                 })
         if clean:
             msg["tool_calls"] = clean
 
     elif accumulated_function_call["name"]:
-        msg["function_call"] = accumulated_function_call
+        msg["function_call"] = {
+            "name": "".join(accumulated_function_call["name"]),
+            "arguments": "".join(accumulated_function_call["arguments"])
+        }
+
+    # Error frames, truncated streams and empty answers would otherwise be replayed in every later run
+    if cache_key and completed and (msg["content"] or msg.get("tool_calls") or msg.get("function_call")):
+        llm_cache_put(cache_key, msg)
 
     return msg
 
 
+# ====================== TOOL EXECUTION ======================
+class _UncachedResult(Exception):
+    """Carries a tool error result out of the cache so it is not stored."""
+    def __init__(self, result):
+        self.result = result
+
+
+@lru_cache(maxsize=1024)
+def _cached_invoke(fname, args_json):
+    """
+    Runs a cacheable tool and returns its result as a JSON string,
+    keeping cache entries hashable and immune to later mutation.
+    """
+    result = resolve_tool(fname)(**json_loads(args_json))
+    if isinstance(result, dict) and "error" in result:
+        raise _UncachedResult(result)
+    return json_dumps(result)
+
+
+class JsonObjectTracker:
+    """
+    Brace-depth counter fed with streamed fragments of a JSON object.
+    Braces inside string values are ignored by tracking quotes and escapes.
+    """
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.complete = False
+
+    def feed(self, fragment):
+        """Returns True exactly once, on the fragment that closes the top-level object."""
+        if self.complete:
+            return False
+        for ch in fragment:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in '{[':
+                self.depth += 1
+            elif ch in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+                    return True
+        return False
+
+
+def tool_call_key(fname, args):
+    """Canonical identity of a tool call, independent of argument key order and whitespace."""
+    return (fname, json_dumps(args, sort_keys=True))
+
+
+def dispatch_tool_early(fname, args_json, early_calls):
+    """
+    Submits a parallel-safe tool call whose arguments have just been streamed completely.
+    The future is stored under tool_call_key so the turn can pick it up once streaming ends,
+    a duplicate of a call that is already running is not submitted again.
+    """
+    if fname not in TOOLS or not TOOLS[fname][1]:
+        return
+    try:
+        args = json_loads(args_json)
+    except ValueError:
+        return
+    if isinstance(args, dict):
+        key = tool_call_key(fname, args)
+        if key not in early_calls:
+            early_calls[key] = TOOL_EXECUTOR.submit(call_tool, fname, args)
+
+
+def call_tool(fname, args):
+    """
+    Runs a single tool under the concurrency limit.
+    Unknown tools and tool exceptions become error results instead of raising.
+    """
+    if fname not in TOOLS:
+        return {"error": "Unknown tool"}
+    cacheable = TOOLS[fname][2]
+    try:
+        with TOOL_SEMAPHORE:
+            if cacheable:
+                return json_loads(_cached_invoke(fname, json_dumps(args, sort_keys=True)))
+            return resolve_tool(fname)(**args)
+    except _UncachedResult as e:
+        return e.result
+    except Exception as e:
+        return {"error": str(e)}
+
+
+# ====================== HISTORY WINDOW ======================
+def _trim_history(history):
+    """
+    Keeps the system prompt plus the most recent messages, at most MAX_CONTEXT_MESSAGES in total.
+    The cut is moved forward to the next user message so whole turns are evicted and no tool
+    result is left without the assistant tool_calls message it answers. A single turn longer
+    than the window keeps its user message pinned after the system prompt and drops its oldest
+    assistant + tool result groups instead.
+    """
+    if len(history) <= MAX_CONTEXT_MESSAGES:
+        return
+    cut = len(history) - (MAX_CONTEXT_MESSAGES - 1)
+    start = next((i for i in range(cut, len(history)) if history[i].get("role") == "user"), None)
+    if start is not None:
+        del history[1:start]
+        return
+    user = next((i for i in range(cut - 1, 0, -1) if history[i].get("role") == "user"), 0)
+    # Groups start at a non-tool message, the newest group is kept even if it alone overflows
+    group_starts = [i for i in range(user + 1, len(history)) if history[i].get("role") != "tool"]
+    cut = len(history) - (MAX_CONTEXT_MESSAGES - 1 - (user > 0))
+    start = next((i for i in group_starts if i >= cut), group_starts[-1] if group_starts else len(history))
+    del history[user + 1:start]
+    del history[1:user]
+
+
 # ====================== CONVERSATION PROCESSOR ======================
-def process_conversation_turn(history):
+def process_conversation_turn(history, on_token=None):
     """
     Handles the loop of calling the model, checking for tools, 
     executing tools, and calling the model again until a text response is given.
+    If on_token is given it is called with every streamed content token.
     Returns the final text content.
     """
     step = 0
@@ -189,7 +623,9 @@ def process_conversation_turn(history):
 
     while step < max_steps:
         step += 1
-        assistant_msg = stream_model(history)
+        _trim_history(history)
+        early_calls = {}
+        assistant_msg = stream_model(history, on_token, early_calls)
         history.append(assistant_msg)
 
         tool_calls = assistant_msg.get("tool_calls")
@@ -204,40 +640,84 @@ def process_conversation_turn(history):
         tool_messages = []
 
         if tool_calls:
-            for tc in tool_calls:
+            calls = []
+            for idx, tc in enumerate(tool_calls):
                 fname = tc["function"]["name"]
                 try:
-                    args = json.loads(tc["function"]["arguments"])
+                    args = json_loads(tc["function"]["arguments"])
                 except:
                     args = {}
 
                 print(f"   [TOOL CALL] {fname}")
                 print(f"   Arguments : {json.dumps(args, indent=4)}")
+                calls.append((idx, fname, args))
+
+            # Identical calls to parallel-safe tools share one execution, including calls
+            # that were already started while the response was streaming
+            keys = [tool_call_key(fname, args) for _, fname, args in calls]
+            shared = dict(early_calls)
+            futures = {idx: shared[keys[idx]] for idx, _, _ in calls if keys[idx] in shared}
+            if early_calls:
+                print(f"   {len(early_calls)} tool call(s) started during streaming")
+
+            # Run the batch in parallel only when every tool in it is safe to interleave
+            parallel = all(TOOLS[fname][1] for _, fname, _ in calls if fname in TOOLS)
+            print(f"   Execution mode: {'parallel' if parallel else 'sequential'}")
+
+            if parallel:
+                # Total latency is the slowest tool instead of the sum
+                for idx, fname, args in calls:
+                    if idx not in futures:
+                        if keys[idx] not in shared:
+                            shared[keys[idx]] = TOOL_EXECUTOR.submit(call_tool, fname, args)
+                        futures[idx] = shared[keys[idx]]
+                duplicates = len(calls) - len(set(keys))
+                if duplicates:
+                    print(f"   {duplicates} duplicate tool call(s) reuse an earlier result")
+                pending = {futures[idx]: fname for idx, fname, _ in calls}
+                for future in as_completed(pending):
+                    print(f"   [TOOL DONE] {pending[future]}")
+                results = [futures[idx].result() for idx, _, _ in calls]
+            else:
+                # Unsafe tools must not overlap anything, so let early-started tools finish first
+                results = [futures[idx].result() if idx in futures else None for idx, _, _ in calls]
+                done = {}
+                for idx, fname, args in calls:
+                    if idx in futures:
+                        continue
+                    if keys[idx] in done:
+                        results[idx] = done[keys[idx]]
+                        continue
+                    results[idx] = call_tool(fname, args)
+                    if fname in TOOLS and TOOLS[fname][1]:
+                        done[keys[idx]] = results[idx]
 
-                result = TOOLS.get(fname)(**args) if fname in TOOLS else {"error": "Unknown tool"}
+            # Collect results in the original call order
+            for idx, fname, args in calls:
+                result = results[idx]
 
-                print("   [TOOL RESULT]")
+                print(f"   [TOOL RESULT] {fname}")
                 print(json.dumps(result, indent=4))
                 print("   ───────────────────────────────\n")
 
                 tool_messages.append({
                     "role": "tool",
-                    "tool_call_id": tc.get("id", "call_1"),
+                    "tool_call_id": tool_calls[idx].get("id", "call_1"),
                     "name": fname,
-                    "content": json.dumps(result)
+                    "content": json_dumps(result, sort_keys=True)
                 })
 
         elif function_call:
             fname = function_call["name"]
             try:
-                args = json.loads(function_call["arguments"])
+                args = json_loads(function_call["arguments"])
             except:
                 args = {}
 
             print(f"   [TOOL CALL] {fname}")
             print(f"   Arguments : {json.dumps(args, indent=4)}")
 
-            result = TOOLS.get(fname)(**args) if fname in TOOLS else {"error": "Unknown tool"}
+            result = call_tool(fname, args)
 
             print("   [TOOL RESULT]")
             print(json.dumps(result, indent=4))
@@ -246,9 +726,11 @@ def process_conversation_turn(history):
             tool_messages.append({
                 "role": "tool",
                 "name": fname,
-                "content": json.dumps(result)
+                "content": json_dumps(result, sort_keys=True)
             })
 
+        # Earlier messages are never rewritten and tool results keep call order with sorted keys,
+        # so the prompt prefix stays byte-identical and the server can reuse its KV cache
         history.extend(tool_messages)
         print("   Results processed — continuing if needed...\n")
     
@@ -269,38 +751,48 @@ class ChatRequestHandler(SimpleHTTPRequestHandler):
             post_data = self.rfile.read(content_length)
             
             try:
-                data = json.loads(post_data.decode('utf-8'))
+                data = json_loads(post_data)
                 user_message = data.get('prompt', '').strip()
-                
-                if not user_message:
-                    self.send_response(400)
-                    self.end_headers()
-                    return
-
-                print(f"\n[WEB REQUEST] User: {user_message}")
-                HISTORY.append({"role": "user", "content": user_message})
-                
-                # Run the conversation loop
-                response_text = process_conversation_turn(HISTORY)
-                
-                # Send response back to web client
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                
-                response_data = {"response": response_text}
-                self.wfile.write(json.dumps(response_data).encode('utf-8'))
-                
             except Exception as e:
                 print(f"Error handling web request: {e}")
-                self.send_response(500)
+                self.send_response(400)
                 self.end_headers()
+                return
+
+            if not user_message:
+                self.send_response(400)
+                self.end_headers()
+                return
+
+            print(f"\n[WEB REQUEST] User: {user_message}")
+
+            # Stream tokens to the web client as Server-Sent Events while the turn runs
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+
+            def send_event(event):
+                try:
+                    self.wfile.write(b"data: " + json_dumps_bytes(event) + b"\n\n")
+                    self.wfile.flush()
+                except OSError:
+                    pass   # client went away, finish the turn anyway so HISTORY stays consistent
+
+            try:
+                with HISTORY_LOCK:
+                    HISTORY.append({"role": "user", "content": user_message})
+                    response_text = process_conversation_turn(HISTORY, on_token=lambda token: send_event({"token": token}))
+                send_event({"done": True, "response": response_text})
+            except Exception as e:
+                print(f"Error handling web request: {e}")
+                send_event({"error": str(e)})
         else:
             self.send_error(404)
 
 def run_server():
     server_address = ('', WEB_PORT)
-    httpd = HTTPServer(server_address, ChatRequestHandler)
+    httpd = ThreadingHTTPServer(server_address, ChatRequestHandler)
     print(f"🌐 Web interface running at http://localhost:{WEB_PORT}")
     httpd.serve_forever()
 
@@ -327,8 +819,9 @@ def chat():
         if not user:
             continue
 
-        HISTORY.append({"role": "user", "content": user})
-        process_conversation_turn(HISTORY)
+        with HISTORY_LOCK:
+            HISTORY.append({"role": "user", "content": user})
+            process_conversation_turn(HISTORY)
 
 
 if __name__ == "__main__":
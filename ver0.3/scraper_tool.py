@@ -30,6 +30,10 @@ def scrape_url(url):
     except Exception as e:
         return {"error": f"An error occurred while scraping: {str(e)}"}
 
+# Read-only tool, safe to run alongside other tool calls and to reuse cached results
+parallel_safe = True
+cacheable = True
+
 # Tool Schema
 schema = {
     "type": "function",
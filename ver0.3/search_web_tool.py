@@ -1,6 +1,10 @@
 import os
 import requests
 
+# Shared keep-alive connection pool, parallel search calls reuse connections to SerpAPI
+_SESSION = requests.Session()
+_SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
 def search_web(query):
     """
     Search the web for information using SerpAPI.
@@ -22,7 +26,7 @@ def search_web(query):
     }
 
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = _SESSION.get(url, params=params, timeout=10)
         response.raise_for_status()
         data = response.json()
         
@@ -53,6 +57,10 @@ def search_web(query):
         return {"error": f"Search request failed: {str(e)}"}
 
 
+# Read-only tool, safe to run alongside other tool calls and to reuse cached results
+parallel_safe = True
+cacheable = True
+
 # Tool Schema
 schema = {
     "type": "function",